@@ -13,9 +13,10 @@ PMD_DATA_UUID    = "FB005C82-02E7-F387-1CAD-8ACD2D8DF0C8"
 # Polar 独自コマンド: ECG取得モードを開始
 ECG_WRITE = bytearray([0x02, 0x00, 0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00])
 
-# 取得したECGデータ (生波形) を蓄積
+# 取得したECGデータ (生波形) をパケット単位の int32 配列で蓄積
 ecg_session_data = []
-ecg_session_time = []
+# パケットごとの (タイムスタンプ, サンプル数)。サンプル毎の時刻は保存時に展開する
+packets = []
 
 def pmd_data_handler(sender: str, data: bytearray):
     """
@@ -28,30 +29,27 @@ def pmd_data_handler(sender: str, data: bytearray):
     # 先頭バイトでタイプ判別 (0x00 = ECG)
     if data[0] == 0x00:
         # data[1..8]: タイムスタンプ (unsigned long, little endian)
-        timestamp = convert_to_unsigned_long(data, 1, 8)
-        samples = data[10:]  # data[10..] が生ECGサンプル群
-        step = 3  # 1サンプルあたり3バイト
-
-        offset = 0
-        while offset + step <= len(samples):
-            ecg_value = convert_array_to_signed_int(samples, offset, step)
-            offset += step
-
-            ecg_session_data.append(ecg_value)
-            ecg_session_time.append(timestamp)
-            # 本来はサンプル毎に (1/130秒 なり1/200秒なり) 加算してもよいが簡略化
-
-def convert_array_to_signed_int(data: bytearray, offset: int, length: int) -> int:
-    """オフセット～lengthバイト分を符号付きリトルエンディアンで読み取る"""
-    return int.from_bytes(
-        data[offset : offset + length], byteorder="little", signed=True
-    )
-
-def convert_to_unsigned_long(data: bytearray, offset: int, length: int) -> int:
-    """オフセット～lengthバイト分を符号なしリトルエンディアンで読み取る"""
-    return int.from_bytes(
-        data[offset : offset + length], byteorder="little", signed=False
-    )
+        timestamp = int(np.frombuffer(data, dtype="<u8", count=1, offset=1)[0])
+        samples = data[10:]  # data[10..] が生ECGサンプル群 (1サンプルあたり3バイト)
+        ecg_values = decode_ecg_samples(samples)
+
+        ecg_session_data.append(ecg_values)
+        packets.append((timestamp, len(ecg_values)))
+
+def decode_ecg_samples(samples: bytearray) -> np.ndarray:
+    """3バイト (符号付きリトルエンディアン) のサンプル列を int32 配列に一括変換する"""
+    n = len(samples) // 3
+    raw = np.frombuffer(samples, dtype=np.uint8, count=n * 3).reshape(n, 3)
+    # 上位バイトの符号ビットから4バイト目を補い '<i4' として解釈
+    sign = np.where(raw[:, 2:3] & 0x80, 0xFF, 0x00).astype(np.uint8)
+    return np.concatenate([raw, sign], axis=1).view("<i4").ravel()
+
+def expand_packet_times() -> np.ndarray:
+    """パケットごとのタイムスタンプをサンプル数分だけ繰り返してサンプル毎の時刻列にする"""
+    timestamps = np.array([ts for ts, _ in packets], dtype=np.uint64)
+    counts = np.array([n for _, n in packets], dtype=np.int64)
+    # 本来はサンプル毎に (1/130秒 なり1/200秒なり) 加算してもよいが簡略化
+    return np.repeat(timestamps, counts)
 
 async def main():
     print(f"=== Attempting to connect to {POLAR_H10_ADDRESS} ===")
@@ -82,17 +80,18 @@ async def main():
 
     # 6) CSV に保存 & Plotly で可視化
     if ecg_session_data:
-        print(f"Total {len(ecg_session_data)} ECG samples were collected.")
+        ecg_data = np.concatenate(ecg_session_data)
+        print(f"Total {len(ecg_data)} ECG samples were collected.")
 
         # CSV 保存
-        np.savetxt("ecg_session_data.csv", ecg_session_data, delimiter=",", fmt="%d")
-        np.savetxt("ecg_session_time.csv", ecg_session_time, delimiter=",", fmt="%d")
+        np.savetxt("ecg_session_data.csv", ecg_data, delimiter=",", fmt="%d")
+        np.savetxt("ecg_session_time.csv", expand_packet_times(), delimiter=",", fmt="%d")
         print("ECG data saved to CSV.")
 
         # Plotly で簡易グラフ
         fig = px.line(
-            x=list(range(len(ecg_session_data))),
-            y=ecg_session_data,
+            x=np.arange(len(ecg_data)),
+            y=ecg_data,
             title="Polar H10 ECG (raw)",
             labels={"x": "Sample Index", "y": "ECG Value"}
         )
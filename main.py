@@ -1,14 +1,27 @@
 import asyncio
+import heapq
+import io
+import logging
 import threading
+from array import array
+from itertools import islice
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from bleak import BleakClient
+from bleak.exc import BleakError
 import numpy as np
-import plotly.express as px
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
-from scipy.signal import find_peaks
+import plotly.graph_objects as go
+from dash import Dash, Patch, dcc, html, no_update
+from dash.dependencies import Input, Output, State
+from scipy.signal import iirfilter, lfilter, lfilter_zi
 import pandas as pd
 from datetime import datetime, timedelta
 
+try:
+    from numba import njit
+except ImportError:  # numba が無い環境では NumPy による一括変換を使う
+    njit = None
+
 # ===== Polar H10 の設定 =====
 POLAR_H10_ADDRESS = "F219825A-C785-E17A-BB0A-313638FF73B2"
 
@@ -16,28 +29,96 @@ PMD_CONTROL_UUID = "FB005C81-02E7-F387-1CAD-8ACD2D8DF0C8"
 PMD_DATA_UUID = "FB005C82-02E7-F387-1CAD-8ACD2D8DF0C8"
 ECG_WRITE = bytearray([0x02, 0x00, 0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00])
 HEART_RATE_MEASUREMENT_CHAR_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
+BLE_RECONNECT_DELAY = 5.0    # 切断・接続失敗から再接続を試みるまでの待ち時間（秒）
+
+logger = logging.getLogger(__name__)
 
 # ===== グローバル変数 =====
-# ECG サンプル（値）とサンプルごとの相対時刻（秒）を保存
-ecg_session_data = []
-ecg_session_time = []
-sample_counter = 0           # サンプル番号（サンプル数）
 SAMPLING_RATE = 100          # 仮のサンプリングレート（Hz）
+ECG_WINDOW_SIZE = SAMPLING_RATE * 10  # 描画・Rピーク検出に使う直近10秒分のサンプル数
+
+# 直近10秒分の ECG サンプルを保持する固定長リングバッファ
+# （書き込み位置は sample_counter % ECG_WINDOW_SIZE）
+ecg_ring = np.zeros(ECG_WINDOW_SIZE, dtype=np.int32)
+# CSV 出力用に全 ECG サンプルをパケット単位の int32 配列で保存
+# （各サンプルの時刻は下記の接続ごとの時刻基準から算出できるので保存しない）
+ecg_session_chunks = []
+# 接続ごとの時刻基準 (接続時点のサンプル番号, セッション開始からの経過秒)
+# ※ 再接続までの空白を時刻に反映するため、各サンプルの時刻は直近の基準 + 経過サンプル数 / SAMPLING_RATE
+ecg_time_anchors = [(0, 0.0)]
+# ECG の書き込みは BLE スレッドのみ、読み出しは描画・CSV 出力側のみなのでロックは使わない
+# 書き込み側は ecg_write_end を先に進めてからリングバッファへ書き込み、
+# 最後に sample_counter を更新して公開する
+sample_counter = 0           # サンプル番号（公開済みのサンプル数）
+ecg_write_end = 0            # 書き込み中のパケットの末尾サンプル番号
 
 # BLE から取得した Heart Rate 値（最新値）
 current_ble_hr = None
 
-# 心拍通知時のログ (timestamp, heart_rate) を記録
-hr_log = []
+# 心拍通知時のログを列ごとに記録（時刻は datetime のリスト、心拍値は符号なし 16bit 配列）
+hr_log_times = []
+hr_log_values = array('H')
 
-# 複数スレッドからのアクセス対策用ロック
+# 心拍ログへの複数スレッドからのアクセス対策用ロック
 data_lock = threading.Lock()
 
+# Rピーク検出は描画コールバックとは別のワーカースレッドで実行
+peak_executor = ThreadPoolExecutor(max_workers=1)
+# 複数タブの描画コールバックが同時に検出ジョブを投入しないよう poll_r_peaks 全体を保護
+peak_lock = threading.Lock()
+peak_future = None           # 実行中の検出ジョブ
+peak_end = 0                 # 最後に検出を投入した時点のサンプル番号
+# 直近に完了した検出結果 (通し番号, Rピークのサンプル番号（セッション先頭からの通し番号）)
+r_peak_result = (0, np.empty(0, dtype=np.int64))
+
+# グラフ描画に渡す ECG の最大点数
+# （10秒窓 = ECG_WINDOW_SIZE 点より小さくし、区間ごとの最小・最大の 2 点に間引く）
+PLOT_MAX_POINTS = 500
+PLOT_INTERVAL_MS = 250       # グラフ更新の間隔（ミリ秒）
+PLOT_MIN_NEW_SAMPLES = 1     # 前回描画からこのサンプル数以上増えたときだけ波形を再描画
+
+# CSV 出力時に一度に DataFrame 化して書き込む行数
+CSV_CHUNK_ROWS = 10_000
+
 # セッション開始時刻（絶対時刻）を記録（これを用いて ECG の相対時刻から絶対時刻を算出）
 session_start_time = datetime.now()
 
 
 # ===== BLE 通知ハンドラ =====
+def unpack_ecg(samples: np.ndarray, out: np.ndarray) -> int:
+    """
+    3 バイト (符号付きリトルエンディアン) の ECG サンプル列 (uint8 配列) を out へ書き込む
+    ※ numba があれば JIT コンパイルしてネイティブのループとして実行
+    ※ 符号拡張は (v ^ 0x800000) - 0x800000 で分岐なしに行う
+    """
+    n = len(samples) // 3
+    for k in range(n):
+        i = 3 * k
+        v = (np.int32(samples[i]) | (np.int32(samples[i + 1]) << 8)
+             | (np.int32(samples[i + 2]) << 16))
+        out[k] = (v ^ 0x800000) - 0x800000
+    return n
+
+
+if njit is not None:
+    unpack_ecg = njit(cache=True)(unpack_ecg)
+
+
+def decode_ecg_samples(samples: bytearray) -> np.ndarray:
+    """
+    3 バイト (符号付きリトルエンディアン) の ECG サンプル列を int32 配列に一括変換
+    ※ numba が無い場合は上位バイトの符号ビットから 4 バイト目を補って '<i4' として解釈
+    """
+    n = len(samples) // 3
+    if njit is not None:
+        out = np.empty(n, dtype=np.int32)
+        unpack_ecg(np.frombuffer(samples, dtype=np.uint8), out)
+        return out
+    raw = np.frombuffer(samples, dtype=np.uint8, count=n * 3).reshape(n, 3)
+    sign = np.where(raw[:, 2:3] & 0x80, 0xFF, 0x00).astype(np.uint8)
+    return np.concatenate([raw, sign], axis=1).view('<i4').ravel()
+
+
 def pmd_data_handler(sender: str, data: bytearray):
     """
     Polar H10 の PMD_DATA_UUID (ECG) 通知受信ハンドラ
@@ -47,20 +128,65 @@ def pmd_data_handler(sender: str, data: bytearray):
         return
 
     if data[0] == 0x00:
-        samples = data[10:]
-        step = 3
-        global sample_counter
-        with data_lock:
-            offset = 0
-            while offset + step <= len(samples):
-                # 3バイトを符号付きリトルエンディアン整数に変換
-                ecg_value = int.from_bytes(samples[offset:offset + step],
-                                           byteorder="little", signed=True)
-                ecg_session_data.append(ecg_value)
-                # サンプル番号から相対時刻（秒）を算出
-                ecg_session_time.append(sample_counter / SAMPLING_RATE)
-                sample_counter += 1
-                offset += step
+        global sample_counter, ecg_write_end
+        ecg_values = decode_ecg_samples(data[10:])
+        start = sample_counter
+        ecg_write_end = start + len(ecg_values)
+        push_ecg_ring(ecg_values, start)
+        ecg_session_chunks.append(ecg_values)
+        # 書き込み完了後に公開（読み出し側は sample_counter を先に読む）
+        sample_counter = ecg_write_end
+
+
+def push_ecg_ring(values: np.ndarray, start: int):
+    """
+    サンプル番号 start から始まる values をリングバッファへ書き込む
+    ※ 末尾で折り返す場合は 2 スライスに分けて書き込む
+    """
+    if len(values) > ECG_WINDOW_SIZE:
+        start += len(values) - ECG_WINDOW_SIZE
+        values = values[-ECG_WINDOW_SIZE:]
+    head = start % ECG_WINDOW_SIZE
+    first = min(len(values), ECG_WINDOW_SIZE - head)
+    ecg_ring[head:head + first] = values[:first]
+    ecg_ring[:len(values) - first] = values[first:]
+
+
+def get_ecg_window(end: int) -> np.ndarray:
+    """
+    サンプル番号 end 直前までの最新10秒分を時系列順に並べた配列を返す
+    ※ 書き込みと並行して呼ばれる場合は read_ecg_window() を使う
+    """
+    count = min(end, ECG_WINDOW_SIZE)
+    if count < ECG_WINDOW_SIZE:
+        return ecg_ring[:count].copy()
+    head = end % ECG_WINDOW_SIZE
+    return np.concatenate((ecg_ring[head:], ecg_ring[:head]))
+
+
+def read_ecg_window() -> tuple[np.ndarray, int]:
+    """
+    ロックを取らずに最新10秒分の ECG 窓と、その末尾のサンプル番号を読み出す
+    ※ コピー中に次のパケットで上書きされた可能性のある先頭側のサンプルは捨てる
+    """
+    end = sample_counter
+    data = get_ecg_window(end)
+    overwritten = ecg_write_end - ECG_WINDOW_SIZE - (end - len(data))
+    if overwritten > 0:
+        data = data[overwritten:]
+    return data, end
+
+
+def ecg_sample_seconds(start: int, end: int, anchors: list) -> np.ndarray:
+    """
+    サンプル番号 start..end-1 の、セッション開始からの経過秒を返す
+    ※ 各サンプルが属する接続の時刻基準 (anchors の直近のもの) から算出
+    """
+    indices = np.arange(start, end)
+    anchor_index = np.array([index for index, _ in anchors])
+    anchor_seconds = np.array([seconds for _, seconds in anchors])
+    k = np.searchsorted(anchor_index, indices, side='right') - 1
+    return anchor_seconds[k] + (indices - anchor_index[k]) / SAMPLING_RATE
 
 
 def parse_heart_rate_measurement(data: bytearray) -> int:
@@ -72,64 +198,322 @@ def parse_heart_rate_measurement(data: bytearray) -> int:
         hr = data[1]
     else:
         hr = int.from_bytes(data[1:3], byteorder='little')
-    print(f"Heart Rate Measurement: {hr} bpm")
+    logger.debug("Heart Rate Measurement: %d bpm", hr)
     return hr
 
 
 def heart_rate_notification_handler(sender: str, data: bytearray):
     """
     Heart Rate Measurement キャラクタリスティックの通知ハンドラ
-    ※ 通知を受けるたびに現在時刻と心拍値を hr_log に記録
+    ※ 通知を受けるたびに現在時刻と心拍値を hr_log_times / hr_log_values に記録
     """
     global current_ble_hr
     hr = parse_heart_rate_measurement(data)
+    # 時刻は datetime のまま記録し、文字列化は CSV 出力時にまとめて行う
+    received_at = datetime.now()
     with data_lock:
         current_ble_hr = hr
-        hr_log.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), hr))
+        hr_log_times.append(received_at)
+        hr_log_values.append(hr)
+
+
+# ===== Rピーク検出 (Pan-Tompkins) =====
+# バンドパス (5-15Hz) の係数はインポート時に一度だけ計算
+PT_BANDPASS_B, PT_BANDPASS_A = iirfilter(2, [5, 15], btype='bandpass', ftype='butter',
+                                         fs=SAMPLING_RATE)
+PT_MWI_SIZE = int(0.15 * SAMPLING_RATE)      # 移動窓積分の幅（150ms）
+PT_REFRACTORY = int(0.2 * SAMPLING_RATE)     # 不応期（200ms）
+PT_LEARNING = 2 * SAMPLING_RATE              # 閾値の初期学習期間（2秒）
+PT_SEARCH_BACK = int(0.1 * SAMPLING_RATE)    # Rピーク位置を遡って探す余裕（100ms）
+
+
+class PanTompkinsDetector:
+    """
+    Pan-Tompkins 法による逐次 Rピーク検出
+    ※ バンドパス → 微分 → 二乗 → 移動窓積分 → 適応閾値 の各段の状態を保持し、
+      呼び出しごとに前回以降の新しいサンプルだけを処理する
+    """
+
+    def __init__(self):
+        self.segment_start = 0
+        self.reset(0)
+
+    def reset(self, start: int):
+        """サンプル番号 start から検出をやり直す（学習期間から再開）"""
+        self.next_index = start
+        self.zi = None
+        self.prev_filtered = 0.0
+        self.sq_tail = np.zeros(PT_MWI_SIZE - 1)
+        self.mwa_tail = np.empty(0)
+        self.learn_end = start + PT_LEARNING
+        self.learn_sum = 0.0
+        self.learn_count = 0
+        self.spki = 0.0
+        self.npki = 0.0
+        self.threshold = 0.0
+        self.last_peak = -PT_REFRACTORY
+        self.peaks = np.empty(0, dtype=np.int64)
+
+    def process(self, data: np.ndarray, start: int, segment_start: int) -> np.ndarray:
+        """
+        サンプル番号 start から始まる ECG 窓 data のうち未処理分を処理し、
+        窓内の Rピークをサンプル番号で返す
+        ※ segment_start は現在の接続で最初に受信したサンプルの番号
+        """
+        end = start + len(data)
+        if segment_start != self.segment_start:
+            # 再接続で信号が途切れたので、新しい接続の先頭から学習期間を含めてやり直す
+            self.segment_start = segment_start
+            self.reset(max(start, segment_start))
+        elif not start < self.next_index <= end:
+            # 取りこぼし等で連続性が失われた場合は窓の先頭からやり直す
+            self.reset(max(start, segment_start))
+        new = data[self.next_index - start:].astype(np.float64)
+        if len(new) > 0:
+            self._feed(new, data, start)
+        self.peaks = self.peaks[self.peaks >= start]
+        return self.peaks
+
+    def _feed(self, new: np.ndarray, data: np.ndarray, start: int):
+        first = self.zi is None
+        if first:
+            self.zi = lfilter_zi(PT_BANDPASS_B, PT_BANDPASS_A) * new[0]
+        filtered, self.zi = lfilter(PT_BANDPASS_B, PT_BANDPASS_A, new, zi=self.zi)
+        if first:
+            self.prev_filtered = filtered[0]
+        squared = np.square(np.diff(filtered, prepend=self.prev_filtered))
+        self.prev_filtered = filtered[-1]
+
+        # 移動窓積分は累積和の差分で計算（前回末尾の PT_MWI_SIZE-1 個を引き継ぐ）
+        ext = np.concatenate((self.sq_tail, squared))
+        csum = np.concatenate(([0.0], np.cumsum(ext)))
+        mwa = (csum[PT_MWI_SIZE:] - csum[:-PT_MWI_SIZE]) / PT_MWI_SIZE
+        self.sq_tail = ext[len(ext) - (PT_MWI_SIZE - 1):]
+
+        # 学習期間中は信号/ノイズレベルの初期値だけを推定
+        n_learn = min(len(mwa), max(0, self.learn_end - self.next_index))
+        if n_learn > 0:
+            self.spki = max(self.spki, 0.25 * mwa[:n_learn].max())
+            self.learn_sum += mwa[:n_learn].sum()
+            self.learn_count += n_learn
+            self.npki = 0.5 * self.learn_sum / self.learn_count
+            self.threshold = self.npki + 0.25 * (self.spki - self.npki)
+
+        # 移動窓積分の極大点を候補とする（前回末尾の 2 点を含めて判定）
+        m = np.concatenate((self.mwa_tail, mwa))
+        m_start = self.next_index - len(self.mwa_tail)
+        candidates = np.flatnonzero((m[1:-1] > m[:-2]) & (m[1:-1] >= m[2:])) + 1
+        self.mwa_tail = m[-2:]
+        self.next_index += len(new)
+
+        # 候補は 1 拍あたり数個なので、適応閾値の更新は候補単位で逐次処理
+        found = []
+        for i, value in zip(candidates.tolist(), m[candidates].tolist()):
+            index = m_start + i
+            if index < self.learn_end:
+                continue
+            if value > self.threshold and index - self.last_peak >= PT_REFRACTORY:
+                self.spki = 0.125 * value + 0.875 * self.spki
+                self.last_peak = index
+                # 実際の Rピークは積分窓の手前にあるので元の ECG から最大点を探す
+                lo = max(index - PT_MWI_SIZE - PT_SEARCH_BACK, start, self.segment_start) - start
+                hi = index - start + 1
+                found.append(start + lo + int(np.argmax(data[lo:hi])))
+            else:
+                self.npki = 0.125 * value + 0.875 * self.npki
+            self.threshold = self.npki + 0.25 * (self.spki - self.npki)
+        if found:
+            self.peaks = np.concatenate((self.peaks, found))
+
+
+r_peak_detector = PanTompkinsDetector()
+
+
+def detect_r_peaks(data: np.ndarray, start: int, segment_start: int) -> np.ndarray:
+    """
+    サンプル番号 start から始まる ECG 窓 data の Rピークを検出
+    ※ 戻り値は窓内の位置ではなくサンプル番号
+    ※ ノイズの除外は Pan-Tompkins の適応閾値 (SPKI/NPKI) に任せる
+    """
+    return r_peak_detector.process(data, start, segment_start)
+
+
+def poll_r_peaks(data: np.ndarray, end: int, segment_start: int) -> tuple[int, np.ndarray]:
+    """
+    完了済みの検出結果を取り込み、新しいサンプルがあれば次の検出をワーカーへ投入
+    ※ 検出完了は待たず、直近に完了した結果 (通し番号, サンプル番号) を返す
+    ※ ジョブは常に末尾サンプル番号の昇順で投入されるので、古い窓で検出器がリセットされることはない
+    """
+    global peak_future, peak_end, r_peak_result
+    with peak_lock:
+        if peak_future is not None and peak_future.done():
+            r_peak_result = (r_peak_result[0] + 1, peak_future.result())
+            peak_future = None
+        if peak_future is None and end > peak_end and len(data) > 0:
+            peak_future = peak_executor.submit(detect_r_peaks, data, end - len(data),
+                                               segment_start)
+            peak_end = end
+        return r_peak_result
 
 
 # ===== BLE 通信メイン =====
 async def ble_main():
-    print(f"=== Polar H10 ({POLAR_H10_ADDRESS}) への接続を試みます ===")
+    """
+    Polar H10 に 1 回接続し、切断されるまで ECG と Heart Rate の通知を受信
+    ※ 再接続は run_ble() 側で行う
+    """
+    logger.info("=== Polar H10 (%s) への接続を試みます ===", POLAR_H10_ADDRESS)
     async with BleakClient(POLAR_H10_ADDRESS, timeout=30.0) as client:
-        print("+++ 接続中 +++")
+        logger.info("+++ 接続中 +++")
         await client.connect(timeout=20.0)
-        print("+++ 接続完了 +++")
-        print("=== ECG取得開始コマンドを送信 ===")
+        logger.info("+++ 接続完了 +++")
+        logger.info("=== ECG取得開始コマンドを送信 ===")
         await client.write_gatt_char(PMD_CONTROL_UUID, ECG_WRITE)
-        print("=== PMD_DATA_UUID で通知受信を開始 ===")
+        logger.info("=== PMD_DATA_UUID で通知受信を開始 ===")
+        # この接続で受信するサンプルの時刻基準を記録
+        ecg_time_anchors.append(
+            (sample_counter, (datetime.now() - session_start_time).total_seconds()))
         await client.start_notify(PMD_DATA_UUID, pmd_data_handler)
-        print("=== Heart Rate Measurement 通知を開始 ===")
+        logger.info("=== Heart Rate Measurement 通知を開始 ===")
         await client.start_notify(HEART_RATE_MEASUREMENT_CHAR_UUID, heart_rate_notification_handler)
-        print("=== リアルタイム ECG & Heart Rate データ受信中... ===")
+        logger.info("=== リアルタイム ECG & Heart Rate データ受信中... ===")
         try:
-            while True:
+            while client.is_connected:
                 await asyncio.sleep(1)
         except asyncio.CancelledError:
             pass
         finally:
-            print("=== 通知受信停止 ===")
-            await client.stop_notify(PMD_DATA_UUID)
-            await client.stop_notify(HEART_RATE_MEASUREMENT_CHAR_UUID)
-    print("+++ 切断完了 +++")
+            if client.is_connected:
+                logger.info("=== 通知受信停止 ===")
+                await client.stop_notify(PMD_DATA_UUID)
+                await client.stop_notify(HEART_RATE_MEASUREMENT_CHAR_UUID)
+    logger.info("+++ 切断完了 +++")
 
 
 def run_ble():
-    asyncio.run(ble_main())
+    """
+    BLE 通信スレッドのエントリポイント
+    ※ イベントループは 1 つだけ作り、切断・接続失敗時も同じループ上で再接続する
+    """
+    # numba の JIT コンパイルは初回呼び出し時に走るので、最初の ECG 通知より前に済ませておく
+    unpack_ecg(np.zeros(3, dtype=np.uint8), np.empty(1, dtype=np.int32))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        while True:
+            try:
+                loop.run_until_complete(ble_main())
+            except (BleakError, asyncio.TimeoutError, OSError) as e:
+                logger.warning("BLE 接続エラー: %s", e)
+            logger.info("=== %.0f 秒後に再接続します ===", BLE_RECONNECT_DELAY)
+            loop.run_until_complete(asyncio.sleep(BLE_RECONNECT_DELAY))
+    finally:
+        loop.close()
+
+
+# ===== CSV 出力 =====
+def iter_ecg_rows(ecg_chunks: list, anchors: list):
+    """
+    ECG サンプルを (timestamp, "ECG", value) として逐次返す
+    ※ 絶対時刻はセッション開始時刻 + 接続ごとの時刻基準からの経過秒で算出
+    """
+    start = 0
+    for chunk in ecg_chunks:
+        end = start + len(chunk)
+        seconds = ecg_sample_seconds(start, end, anchors)
+        for sec, value in zip(seconds.tolist(), chunk.tolist()):
+            yield session_start_time + timedelta(seconds=sec), "ECG", value
+        start = end
+
+
+def iter_combined_rows(ecg_chunks: list, anchors: list, hr_times: list, hr_values: array):
+    """
+    ECG サンプルと心拍通知ログを時刻順にマージした (timestamp, source, value) を逐次返す
+    ※ どちらも記録順＝時刻順なので、全体をソートせず heapq.merge で 1 パスでマージ
+    """
+    ecg_rows = iter_ecg_rows(ecg_chunks, anchors)
+    # 心拍通知ログは datetime のまま記録しているので変換不要
+    hr_rows = ((ts, "Heart Rate", hr) for ts, hr in zip(hr_times, hr_values))
+    return heapq.merge(ecg_rows, hr_rows, key=itemgetter(0))
+
+
+def write_combined_csv(f, ecg_chunks: list, anchors: list, hr_times: list, hr_values: array):
+    """
+    統合 CSV を CSV_CHUNK_ROWS 行ずつ DataFrame 化して f へ追記
+    ※ 全行を一度にメモリへ展開しない
+    """
+    rows = iter_combined_rows(ecg_chunks, anchors, hr_times, hr_values)
+    header = True
+    while True:
+        chunk = list(islice(rows, CSV_CHUNK_ROWS))
+        if chunk or header:
+            # 列ごとに型を指定して構築（行ごとの型推論を避け、source はカテゴリ型にする）
+            timestamps, sources, values = zip(*chunk) if chunk else ((), (), ())
+            df = pd.DataFrame({
+                "timestamp": pd.to_datetime(list(timestamps)),
+                "source": pd.Categorical(sources, categories=["ECG", "Heart Rate"]),
+                "value": np.asarray(values, dtype=np.int32),
+            })
+            df.to_csv(f, header=header, index=False, chunksize=CSV_CHUNK_ROWS,
+                      date_format="%Y-%m-%d %H:%M:%S.%f")
+            header = False
+        if len(chunk) < CSV_CHUNK_ROWS:
+            break
+
+
+def build_combined_csv(ecg_chunks: list, anchors: list, hr_times: list,
+                       hr_values: array) -> str:
+    """統合 CSV の内容を文字列として生成"""
+    buf = io.StringIO()
+    write_combined_csv(buf, ecg_chunks, anchors, hr_times, hr_values)
+    return buf.getvalue()
 
 
 # ===== Dash アプリの設定 =====
+def build_ecg_figure() -> go.Figure:
+    """
+    ECG 波形と Rピークの 2 トレースを持つ初期 Figure
+    ※ 以降の更新では Figure を作り直さず、Patch で各トレースのデータだけを差し替える
+    """
+    fig = go.Figure([
+        go.Scatter(x=[], y=[], mode='lines', name='ECG'),
+        go.Scatter(x=[], y=[], mode='markers', marker=dict(color='red', size=8),
+                   name='R Peaks'),
+    ])
+    fig.update_layout(title="リアルタイム ECG (最新10秒)",
+                      xaxis_title="Time (s)", yaxis_title="ECG Value")
+    return fig
+
+
+def decimate_for_plot(times: np.ndarray, data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    描画用に ECG を最大 PLOT_MAX_POINTS 点程度まで間引く
+    ※ 区間ごとに最小・最大の 2 点を残して Rピークの尖りを潰さない
+    """
+    if len(data) <= PLOT_MAX_POINTS:
+        return times, data
+    stride = -(-len(data) // (PLOT_MAX_POINTS // 2))
+    n = len(data) // stride * stride
+    bins = data[:n].reshape(-1, stride)
+    idx = np.sort(np.stack((bins.argmin(axis=1), bins.argmax(axis=1)), axis=1), axis=1)
+    idx = (idx + np.arange(0, n, stride)[:, None]).ravel()
+    idx = np.concatenate((idx, np.arange(n, len(data))))
+    return times[idx], data[idx]
+
+
 app = Dash(__name__)
 app.layout = html.Div([
     html.H1("リアルタイム ECG, R-R間隔 & Heart Rate 可視化"),
-    dcc.Graph(id='ecg-graph'),
+    dcc.Graph(id='ecg-graph', figure=build_ecg_figure()),
     html.Div(id='hr-display', style={'fontSize': 24, 'marginTop': 20}),
     # 統合 CSV 出力用のボタンと Download コンポーネント
     html.Button("CSV出力 (統合)", id="btn-combined-csv", n_clicks=0, style={'marginTop': 20}),
     dcc.Download(id="download-combined-csv"),
+    # ブラウザ (タブ) ごとに前回描画した状態 {"end": 窓の末尾サンプル番号, "peaks": 検出結果の通し番号}
+    dcc.Store(id='plot-state'),
     dcc.Interval(
         id='interval-component',
-        interval=1000,  # 1秒ごとに更新
+        interval=PLOT_INTERVAL_MS,  # 250ms ごとに更新（新しいサンプルが無ければ描画しない）
         n_intervals=0
     )
 ])
@@ -137,40 +521,45 @@ app.layout = html.Div([
 
 @app.callback(
     [Output('ecg-graph', 'figure'),
-     Output('hr-display', 'children')],
-    [Input('interval-component', 'n_intervals')]
+     Output('hr-display', 'children'),
+     Output('plot-state', 'data')],
+    [Input('interval-component', 'n_intervals')],
+    [State('plot-state', 'data')]
 )
-def update_graph(n):
-    with data_lock:
-        data = ecg_session_data.copy()
-        times = ecg_session_time.copy()
-        ble_hr = current_ble_hr
+def update_graph(n, plot_state):
     # 最新10秒間のデータのみプロット
-    window_size = SAMPLING_RATE * 10
-    if len(data) > window_size:
-        data = data[-window_size:]
-        times = times[-window_size:]
-    # DataFrame に変換して Plotly Express に渡す
-    df = pd.DataFrame({"time": times, "ecg": data})
-    fig = px.line(df, x="time", y="ecg", title="リアルタイム ECG (最新10秒)")
-    fig.update_layout(xaxis_title="Time (s)", yaxis_title="ECG Value")
+    data, end = read_ecg_window()
+    anchors = list(ecg_time_anchors)
+    ble_hr = current_ble_hr
     # Rピーク検出（ECG から心拍数推定）
-    if len(data) > 0:
-        data_array = np.array(data)
-        peaks, _ = find_peaks(data_array, distance=SAMPLING_RATE * 0.3,
-                                prominence=0.5 * np.std(data_array))
-        fig.add_scatter(x=np.array(times)[peaks],
-                        y=data_array[peaks],
-                        mode='markers',
-                        marker=dict(color='red', size=8),
-                        name='R Peaks')
+    # 検出はワーカーで行い、表示中の窓に含まれるピークだけを描画
+    peak_version, peak_indices = poll_r_peaks(data, end, anchors[-1][0])
+    if (plot_state is not None
+            and 0 <= end - plot_state['end'] < PLOT_MIN_NEW_SAMPLES
+            and peak_version == plot_state['peaks']):
+        # このタブに描画済みの状態から新しいサンプルも検出結果も無ければグラフはそのまま
+        fig = no_update
+        plot_state = no_update
+    else:
+        plot_state = {'end': end, 'peaks': peak_version}
+        # セッション開始からの経過秒は接続ごとの時刻基準とサンプル番号から算出
+        start = end - len(data)
+        times = ecg_sample_seconds(start, end, anchors)
+        peaks = peak_indices[peak_indices >= start] - start
+        # 既存の 2 トレースのデータだけを差し替える（波形は間引いてから渡す）
+        plot_times, plot_data = decimate_for_plot(times, data)
+        fig = Patch()
+        fig['data'][0]['x'] = plot_times
+        fig['data'][0]['y'] = plot_data
+        fig['data'][1]['x'] = times[peaks]
+        fig['data'][1]['y'] = data[peaks]
 
     current_time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     display_text = (
         f"測定 Heart Rate: {ble_hr if ble_hr is not None else '---'} BPM, "
         f"現在時刻: {current_time_str}"
     )
-    return fig, display_text
+    return fig, display_text, plot_state
 
 
 @app.callback(
@@ -179,34 +568,25 @@ def update_graph(n):
     prevent_initial_call=True,
 )
 def generate_combined_csv(n_clicks):
+    # ECG はパケット単位の配列を追記するだけなのでリストの浅いコピーで十分
+    ecg_chunks = list(ecg_session_chunks)
+    # 時刻基準はチャンクの後に取得（基準は新しい接続のサンプルより先に追加されるので、
+    # 取得済みのサンプルの基準は必ず含まれる）
+    anchors = list(ecg_time_anchors)
     with data_lock:
-        ecg_times = ecg_session_time.copy()
-        ecg_values = ecg_session_data.copy()
-        hr_data_local = list(hr_log)
-    rows = []
-    # ECG サンプルは、セッション開始時刻 + 相対秒数 で絶対時刻を算出
-    for rel_time, ecg_value in zip(ecg_times, ecg_values):
-        abs_time = session_start_time + timedelta(seconds=rel_time)
-        rows.append({
-            "timestamp": abs_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
-            "source": "ECG",
-            "value": ecg_value
-        })
-    # 心拍通知ログは既に絶対時刻（文字列）で記録しているのでそのまま追加
-    for ts, hr in hr_data_local:
-        rows.append({
-            "timestamp": ts,
-            "source": "Heart Rate",
-            "value": hr
-        })
-    # タイムスタンプ順にソート
-    rows.sort(key=lambda row: pd.to_datetime(row["timestamp"]))
-    df = pd.DataFrame(rows)
-    return dcc.send_data_frame(df.to_csv, "combined_data.csv", index=False)
+        hr_times = list(hr_log_times)
+        hr_values = hr_log_values[:]
+    # Dash 2.x のコールバックは同期関数のみだが、開発サーバはリクエストごとに別スレッドで
+    # 処理するので、CSV 生成中もグラフ更新のコールバックは止まらない
+    return dcc.send_string(build_combined_csv(ecg_chunks, anchors, hr_times, hr_values),
+                           "combined_data.csv")
 
 
 # ===== メイン処理 =====
 if __name__ == "__main__":
+    # 心拍ごとの debug ログは既定では出力しない
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
     # BLE 通信は別スレッドで実行（Dash サーバはメインスレッド）
     ble_thread = threading.Thread(target=run_ble, daemon=True)
     ble_thread.start()